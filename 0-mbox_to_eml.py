@@ -25,13 +25,21 @@ Output:
 
 import os
 import sys
+import time
 import email
 from email.header import decode_header
+from email.parser import BytesHeaderParser
 from email.utils import parsedate_to_datetime
 from pathlib import Path
 from datetime import datetime
 from color_utils import *
-import re
+from header_utils import get_header_block
+
+# Number of bytes read from the mbox at a time
+MBOX_CHUNK_SIZE = 1024 * 1024
+
+# Seconds between progress messages
+PROGRESS_INTERVAL = 0.5
 
 def decode_header_str(header_str):
     """
@@ -61,6 +69,22 @@ def decode_header_str(header_str):
         print(warning(f"Warning: Could not decode header: {e}"))
         return str(header_str)
 
+class FilenameCharMap(dict):
+    """
+    Translation table for str.translate that keeps letters, digits, spaces,
+    '-' and '_' and replaces every other character with '_'.
+    Each character is checked once and the result is cached in the table.
+    """
+    def __missing__(self, codepoint):
+        char = chr(codepoint)
+        if char.isalnum() or char in (' ', '-', '_'):
+            self[codepoint] = codepoint
+        else:
+            self[codepoint] = '_'
+        return self[codepoint]
+
+FILENAME_CHARS = FilenameCharMap()
+
 def sanitize_filename(subject, date, counter):
     """
     Create a safe filename from the email subject and date.
@@ -68,7 +92,7 @@ def sanitize_filename(subject, date, counter):
     """
     if subject:
         # Remove or replace problematic characters
-        safe_subject = "".join(c if c.isalnum() or c in (' ', '-', '_') else '_' for c in subject)
+        safe_subject = subject.translate(FILENAME_CHARS)
         safe_subject = safe_subject.strip()[:50]  # Limit length
         if safe_subject:
             return f"{date.strftime('%Y%m%d_%H%M%S')}_{safe_subject}_{counter}.eml"
@@ -86,20 +110,53 @@ def get_email_date(msg):
         pass
     return datetime.now()
 
-def split_mbox(mbox_content):
+def iter_mbox(mbox_path):
     """
-    Split mbox content into individual email messages.
-    Returns a list of raw email messages.
+    Iterate over the messages in an mbox file.
+    Reads the file in chunks and yields each raw message as bytes, so only
+    one message is held in memory at a time.
     """
-    # Regular expression to match mbox message separator
-    # This matches "From " at the start of a line, followed by an email address and date
-    separator = re.compile(r'(?:^|\n)From [^\n]+\n')
+    # Start with a blank line so a "From " line at the top of the file is a separator
+    buf = bytearray(b'\n\n')
+    start = 0  # Start of the current message in buf
+    pos = 0    # Where to resume searching for the next separator
     
-    # Split the content at each separator
-    messages = separator.split(mbox_content)
+    with open(mbox_path, 'rb') as f:
+        while True:
+            chunk = f.read(MBOX_CHUNK_SIZE)
+            # Terminate the last line once the end of the file is reached
+            buf += chunk or b'\n'
+            
+            while True:
+                nl = buf.find(b'\nFrom ', pos)
+                if nl < 0:
+                    # Keep a possible partial separator at the end for the next chunk
+                    pos = max(start, len(buf) - 5)
+                    break
+                line_end = buf.find(b'\n', nl + 1)
+                if line_end < 0:
+                    pos = nl
+                    break
+                # Only a "From " line directly after a blank line starts a new message
+                if buf[nl - 1:nl] == b'\n' or buf[nl - 2:nl] == b'\n\r':
+                    message = bytes(buf[start:nl]).strip()
+                    if message:
+                        yield message
+                    start = line_end + 1
+                pos = nl + 1
+            
+            if not chunk:
+                break
+            
+            # Drop messages that have been yielded, keeping two bytes for the blank line check
+            consumed = max(start - 2, 0)
+            del buf[:consumed]
+            start -= consumed
+            pos -= consumed
     
-    # Filter out empty messages and strip whitespace
-    return [msg.strip() for msg in messages if msg.strip()]
+    message = bytes(buf[start:]).strip()
+    if message:
+        yield message
 
 def save_email_message(message_content, output_path):
     """
@@ -135,28 +192,22 @@ def convert_to_eml(mbox_path, output_dir):
     output_dir.mkdir(parents=True, exist_ok=True)
     
     try:
-        # Read the entire mbox file with UTF-8 encoding and replacement for invalid chars
         print(section("Processing Mbox File"))
         print(info(f"Reading: {mbox_path}"))
         print(info(f"Output directory: {output_dir}"))
         
-        with open(mbox_path, 'r', encoding='utf-8', errors='replace') as f:
-            mbox_content = f.read()
-        
-        # Split into individual messages
-        messages = split_mbox(mbox_content)
-        total_messages = len(messages)
-        print(bullet(f"Total messages found: {total_messages}"))
-        
         # Track statistics
+        total_messages = 0
         processed = 0
         errors = 0
+        last_progress = time.monotonic()
         
-        # Process each message
-        for i, message_content in enumerate(messages, 1):
+        # Process each message as it is read from the mbox
+        for i, message_content in enumerate(iter_mbox(mbox_path), 1):
+            total_messages += 1
             try:
-                # Parse the message
-                msg = email.message_from_string(message_content)
+                # Parse only the header block, so large attachments are never scanned
+                msg = BytesHeaderParser().parsebytes(get_header_block(message_content))
                 
                 # Get message date and subject for filename
                 date = get_email_date(msg)
@@ -172,9 +223,11 @@ def convert_to_eml(mbox_path, output_dir):
                 else:
                     errors += 1
                 
-                # Show progress every 100 files
-                if processed % 100 == 0:
-                    print(bullet(f"Processed {processed}/{total_messages} emails..."))
+                # Show progress at most every PROGRESS_INTERVAL seconds
+                now = time.monotonic()
+                if now - last_progress >= PROGRESS_INTERVAL:
+                    print(bullet(f"Processed {processed} emails..."))
+                    last_progress = now
                     
             except Exception as e:
                 print(error(f"Error processing message {i}: {e}"))
@@ -32,31 +32,160 @@ Note:
 
 import os
 import sys
+import codecs
 import email
 import email.utils
+from email.generator import BytesGenerator
+from email.header import decode_header
 from color_utils import *
 from datetime import datetime
 import re
 from pathlib import Path
-from folder_utils import setup_output_directory
-import re
-from datetime import datetime
-import email.utils
+from concurrent.futures import ProcessPoolExecutor
+from folder_utils import ensure_directory, process_in_batches, setup_output_directory
+from header_utils import get_header_block
 from dateutil import parser as date_parser
 import pytz
 
+# Optional: google-re2 makes scanning email bodies for dates much faster
+try:
+    import re2
+except ImportError:
+    re2 = None
+
+# Whitespace between the parts of a date. Written out instead of \s (and paired with
+# re.ASCII below), so the stdlib and RE2 engines match exactly the same characters.
+# Includes the non-breaking space, which is common in HTML emails.
+DATE_SPACE = r'[ \t\n\r\f\v\xa0]'
+
+# Date patterns searched for in the email body and headers, with optional time components
+DATE_PATTERNS = [re.compile(p.replace('SPACE', DATE_SPACE), re.ASCII) for p in (
+    # Format like "1 November 2021 20:00", "1 Nov 2021 20:00" or Norwegian "1 november 2021 20:00"
+    r'(\d{1,2}SPACE+(?:January|February|March|April|May|June|July|August|September|October|November|December'
+    r'|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec'
+    r'|januar|februar|mars|april|mai|juni|juli|august|september|oktober|november|desember)SPACE+\d{4})'
+    r'(?:SPACE+(\d{1,2}:\d{2}))?',
+    
+    # dd.mm.yyyy HH:MM or dd/mm/yyyy HH:MM
+    r'(\d{1,2}[./]\d{1,2}[./]\d{2,4})(?:SPACE+(\d{1,2}:\d{2}))?',
+    
+    # yyyy-mm-dd HH:MM
+    r'(\d{4}-\d{1,2}-\d{1,2})(?:SPACE+(\d{1,2}:\d{2}))?',
+    
+    # Compact formats
+    r'(\d{8})(?:_?(\d{4}))?',  # YYYYMMDD_HHMM or YYYYMMDD
+    r'(\d{6})',                 # YYMMDD
+)]
+
+# All date patterns combined into one regex, so a text only has to be scanned once.
+# Pattern i becomes the named group "p<i>", followed by its own date and time groups.
+# Every pattern starts with a digit, so the lookahead skips other positions quickly.
+COMBINED_DATE_ALTERNATIVES = '|'.join(f'(?P<p{i}>{p.pattern})' for i, p in enumerate(DATE_PATTERNS))
+COMBINED_DATE_PATTERN = re.compile(r'(?=\d)(?:' + COMBINED_DATE_ALTERNATIVES + ')', re.ASCII)
+
+# Texts with non-ASCII spaces and digits that both regex engines must handle the same way
+ENGINE_CHECK_SAMPLES = (
+    '5\xa0november\xa02021\xa020:00',
+    '5\u2003November 2021',
+    '\u0661\u0662.\u0660\u0663.\u0662\u0660\u0662\u0660 and 12.03.2020',
+    '2021-05-06\xa010:00 or \uff12\uff10\uff12\uff11-05-06',
+    'ref \u0662\u0660\u0662\u0661\u0660\u0665\u0660\u0666_1200 20210506_1200',
+)
+
+def find_date_matches(pattern, text):
+    """List the position and groups of every date match, for comparing regex engines."""
+    return [(m.span(), m.groups()) for m in pattern.finditer(text)]
+
+if re2:
+    # RE2 scans in a single linear pass without backtracking. Only use it if it
+    # finds exactly the same dates, so results don't depend on what is installed.
+    RE2_DATE_PATTERN = re2.compile(COMBINED_DATE_ALTERNATIVES)
+    if all(find_date_matches(RE2_DATE_PATTERN, sample) == find_date_matches(COMBINED_DATE_PATTERN, sample)
+           for sample in ENGINE_CHECK_SAMPLES):
+        COMBINED_DATE_PATTERN = RE2_DATE_PATTERN
+
+# Number of files sent to a worker process at a time
+BATCH_SIZE = 64
+
+# Number of bytes of each email body part that are searched for dates
+MAX_BODY_SCAN_BYTES = 64 * 1024
+
+# Month numbers for the month names in the first date pattern
+MONTH_NUMBERS = {}
+for number, name in enumerate(['January', 'February', 'March', 'April', 'May', 'June', 'July',
+                               'August', 'September', 'October', 'November', 'December'], 1):
+    MONTH_NUMBERS[name] = number
+    MONTH_NUMBERS[name[:3]] = number
+for number, name in enumerate(['januar', 'februar', 'mars', 'april', 'mai', 'juni', 'juli',
+                               'august', 'september', 'oktober', 'november', 'desember'], 1):
+    MONTH_NUMBERS[name] = number
+
+# Exact date formats of the numeric date patterns, by pattern index
+EXACT_DATE_FORMATS = {
+    2: '%Y-%m-%d',  # yyyy-mm-dd
+    3: '%Y%m%d',    # YYYYMMDD
+    4: '%y%m%d',    # YYMMDD
+}
+
+# Filename patterns with time components
+FILENAME_PATTERNS = [(re.compile(p), fmt) for p, fmt in (
+    (r'(\d{8})_(\d{6})', '%Y%m%d_%H%M%S'),  # YYYYMMDD_HHMMSS
+    (r'(\d{14})', '%Y%m%d%H%M%S'),          # YYYYMMDDHHMMSS
+)]
+
+# Date-only filename patterns (time is assumed to be 00:00:00)
+DATE_ONLY_FILENAME_PATTERNS = [(re.compile(p), fmt) for p, fmt in (
+    (r'(\d{4})-(\d{2})-(\d{2})', '%Y-%m-%d'),      # yyyy-mm-dd
+    (r'(\d{4})(\d{2})(\d{2})', '%Y%m%d'),          # yyyymmdd
+    (r'(\d{2})(\d{2})(\d{2})', '%y%m%d'),          # yymmdd
+    (r'(\d{2})-(\d{2})-(\d{4})', '%d-%m-%Y'),      # dd-mm-yyyy
+    (r'(\d{2})(\d{2})(\d{4})', '%d%m%Y'),          # ddmmyyyy
+    (r'(\d{2})/(\d{2})/(\d{4})', '%d/%m/%Y'),      # dd/mm/yyyy
+    (r'(\d{2})\.(\d{2})\.(\d{4})', '%d.%m.%Y'),    # dd.mm.yyyy
+    (r'(\d{4})/(\d{2})/(\d{2})', '%Y/%m/%d'),      # yyyy/mm/dd
+    (r'(\d{4})\.(\d{2})\.(\d{2})', '%Y.%m.%d'),    # yyyy.mm.dd
+)]
+
+# Encodings that bytes.decode handles without a codec lookup
+FAST_PATH_ENCODINGS = {'utf-8', 'utf8', 'ascii', 'iso-8859-1', 'iso8859-1', 'latin-1', 'latin1'}
+
+# Decode functions of other codecs, cached by encoding name
+DECODERS = {}
+
+
+def parse_exact_date(date_str, time_str, pattern_index):
+    """
+    Parse a date (and optional time) matched by DATE_PATTERNS[pattern_index]
+    using the exact format of that pattern.
+    Raises ValueError if the date doesn't fit the format.
+    """
+    if pattern_index == 0:
+        # "1 November 2021", "1 Nov 2021" or "1 november 2021"
+        day, month, year = date_str.split()
+        parsed = datetime(int(year), MONTH_NUMBERS[month], int(day))
+    elif pattern_index == 1:
+        # dd.mm.yyyy or dd/mm/yyyy, with a 2 or 4 digit year
+        day, month, year = re.split('[./]', date_str)
+        fmt = '%d.%m.%y' if len(year) == 2 else '%d.%m.%Y'
+        parsed = datetime.strptime(f"{day}.{month}.{year}", fmt)
+    else:
+        parsed = datetime.strptime(date_str, EXACT_DATE_FORMATS[pattern_index])
+    
+    if time_str:
+        # HH:MM, or HHMM for the compact format
+        if ':' in time_str:
+            hour, minute = time_str.split(':')
+        else:
+            hour, minute = time_str[:2], time_str[2:]
+        parsed = parsed.replace(hour=int(hour), minute=int(minute))
+    
+    return parsed
 
 def parse_date_header(email_content, filename=None):
     """
-    Extract and parse dates from email content with multiple fallback methods.
+    Extract and parse dates from the raw bytes of an email with multiple fallback methods.
     Returns a datetime object or None if no valid date found.
     """
-    import re
-    from datetime import datetime
-    import email.utils
-    from dateutil import parser as date_parser
-    import pytz
-
     def try_parse_date(date_str):
         """Try to parse a date string using multiple methods."""
         try:
@@ -70,8 +199,15 @@ def parse_date_header(email_content, filename=None):
         except:
             return None
 
-    def try_parse_datetime_parts(date_str, time_str=None):
+    def try_parse_datetime_parts(date_str, time_str=None, pattern_index=None):
         """Try to parse date and optional time components."""
+        # Try the exact format of the matching pattern first, it's much faster than dateutil
+        if pattern_index is not None:
+            try:
+                return parse_exact_date(date_str, time_str, pattern_index)
+            except ValueError:
+                pass
+        
         try:
             # If we have both date and time, combine them
             if time_str:
@@ -82,93 +218,87 @@ def parse_date_header(email_content, filename=None):
             return None
 
     try:
-        msg = email.message_from_string(email_content)
-        
-        # 1. Try standard Date header first
-        date_str = msg.get('Date')
+        # 1. Try standard Date header first, parsing only the header block
+        headers = email.message_from_bytes(get_header_block(email_content))
+        date_str = decode_raw_header(headers.get('Date', ''))
         if date_str:
             parsed_date = try_parse_date(date_str)
             if parsed_date:
                 return parsed_date
 
-        # 2. Define date patterns with optional time components
-        date_patterns = [
-            # Format like "1 November 2021 20:00"
-            r'(\d{1,2}\s+(?:January|February|March|April|May|June|July|August|September|October|November|December)\s+\d{4})(?:\s+(\d{1,2}:\d{2}))?',
-            
-            # Format like "1 Nov 2021 20:00"
-            r'(\d{1,2}\s+(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)\s+\d{4})(?:\s+(\d{1,2}:\d{2}))?',
-            
-            # Norwegian month names
-            r'(\d{1,2}\s+(?:januar|februar|mars|april|mai|juni|juli|august|september|oktober|november|desember)\s+\d{4})(?:\s+(\d{1,2}:\d{2}))?',
-            
-            # dd.mm.yyyy HH:MM or dd/mm/yyyy HH:MM
-            r'(\d{1,2}[./]\d{1,2}[./]\d{2,4})(?:\s+(\d{1,2}:\d{2}))?',
-            
-            # yyyy-mm-dd HH:MM
-            r'(\d{4}-\d{1,2}-\d{1,2})(?:\s+(\d{1,2}:\d{2}))?',
-            
-            # Compact formats
-            r'(\d{8})(?:_?(\d{4}))?',  # YYYYMMDD_HHMM or YYYYMMDD
-            r'(\d{6})',                 # YYMMDD
-        ]
-
         # Process email content
+        def parse_match(match, index):
+            """Parse the date and optional time groups of a match of DATE_PATTERNS[index]."""
+            first_group = COMBINED_DATE_PATTERN.groupindex[f'p{index}']
+            groups = match.groups()[first_group:first_group + DATE_PATTERNS[index].groups]
+            if len(groups) == 2:
+                date_part, time_part = groups
+                if date_part:
+                    return try_parse_datetime_parts(date_part, time_part, index)
+            elif len(groups) == 1:
+                return try_parse_datetime_parts(groups[0], pattern_index=index)
+            return None
+
         def search_content(text):
-            for pattern in date_patterns:
-                matches = re.finditer(pattern, text)
+            # Scan the text once. Earlier patterns take priority over later ones,
+            # so matches of the first pattern are tried right away and the rest
+            # are kept until the whole text has been scanned.
+            later_matches = [[] for _ in DATE_PATTERNS]
+            for match in COMBINED_DATE_PATTERN.finditer(text):
+                index = int(match.lastgroup[1:])
+                if index == 0:
+                    parsed = parse_match(match, index)
+                    if parsed:
+                        return parsed
+                else:
+                    later_matches[index].append(match)
+            
+            for index, matches in enumerate(later_matches):
                 for match in matches:
-                    if len(match.groups()) == 2:
-                        date_part, time_part = match.groups()
-                        if date_part:
-                            parsed = try_parse_datetime_parts(date_part, time_part)
-                            if parsed:
-                                return parsed
-                    elif len(match.groups()) == 1:
-                        date_part = match.group(1)
-                        parsed = try_parse_datetime_parts(date_part)
-                        if parsed:
-                            return parsed
+                    parsed = parse_match(match, index)
+                    if parsed:
+                        return parsed
             return None
 
-        # First check the email body
+        # Then check headers, which are cheap to search
+        for header in ['Subject', 'Message-ID', 'X-Mail-Created-Date']:
+            header_value = decode_raw_header(headers.get(header, ''))
+            if header_value:
+                parsed_date = search_content(header_value)
+                if parsed_date:
+                    return parsed_date
+
+        # Then parse the full message and check the email body
+        msg = email.message_from_bytes(email_content)
         if msg.is_multipart():
-            for part in msg.walk():
-                if part.get_content_type() in ['text/plain', 'text/html']:
-                    try:
-                        content = part.get_payload(decode=True).decode('utf-8', errors='replace')
-                        parsed_date = search_content(content)
-                        if parsed_date:
-                            return parsed_date
-                    except:
-                        continue
+            body_parts = [
+                part for part in msg.walk()
+                if part.get_content_type() in ['text/plain', 'text/html']
+                and part.get_content_disposition() != 'attachment'
+            ]
         else:
+            body_parts = [msg]
+
+        for part in body_parts:
             try:
-                content = msg.get_payload(decode=True).decode('utf-8', errors='replace')
-                parsed_date = search_content(content)
+                # Dates are found near the top, so only the start of long bodies is searched
+                raw_body = part.get_payload(decode=True)[:MAX_BODY_SCAN_BYTES]
+                parsed_date = search_content(raw_body.decode('utf-8', errors='replace'))
                 if parsed_date:
                     return parsed_date
             except:
                 pass
-
-        # Then check headers
-        for header in ['Subject', 'Message-ID', 'X-Mail-Created-Date']:
-            header_value = msg.get(header, '')
-            if header_value:
-                parsed_date = search_content(header_value)
-                if parsed_date:
-                    return parsed_date
+            
+            # The first plain text part is the message itself, and an HTML
+            # alternative after it holds the same text
+            if part.get_content_type() == 'text/plain':
+                break
 
         # If still no date found, try the filename itself as the last resort
         if filename:
             # First try formats with time components
-            filename_patterns = [
-                (r'(\d{8})_(\d{6})', '%Y%m%d_%H%M%S'),  # YYYYMMDD_HHMMSS
-                (r'(\d{14})', '%Y%m%d%H%M%S'),          # YYYYMMDDHHMMSS
-            ]
-            
-            for pattern, fmt in filename_patterns:
-                match = re.search(pattern, filename)
+            for pattern, fmt in FILENAME_PATTERNS:
+                match = pattern.search(filename)
                 if match:
                     try:
                         if len(match.groups()) == 2:
@@ -180,20 +310,8 @@ def parse_date_header(email_content, filename=None):
                         continue
             
             # Then try date-only formats (assume 00:00:00 for time)
-            date_only_patterns = [
-                (r'(\d{4})-(\d{2})-(\d{2})', '%Y-%m-%d'),      # yyyy-mm-dd
-                (r'(\d{4})(\d{2})(\d{2})', '%Y%m%d'),          # yyyymmdd
-                (r'(\d{2})(\d{2})(\d{2})', '%y%m%d'),          # yymmdd
-                (r'(\d{2})-(\d{2})-(\d{4})', '%d-%m-%Y'),      # dd-mm-yyyy
-                (r'(\d{2})(\d{2})(\d{4})', '%d%m%Y'),          # ddmmyyyy
-                (r'(\d{2})/(\d{2})/(\d{4})', '%d/%m/%Y'),      # dd/mm/yyyy
-                (r'(\d{2})\.(\d{2})\.(\d{4})', '%d.%m.%Y'),    # dd.mm.yyyy
-                (r'(\d{4})/(\d{2})/(\d{2})', '%Y/%m/%d'),      # yyyy/mm/dd
-                (r'(\d{4})\.(\d{2})\.(\d{2})', '%Y.%m.%d'),    # yyyy.mm.dd
-            ]
-            
-            for pattern, fmt in date_only_patterns:
-                match = re.search(pattern, filename)
+            for pattern, fmt in DATE_ONLY_FILENAME_PATTERNS:
+                match = pattern.search(filename)
                 if match:
                     try:
                         if len(match.groups()) == 3:
@@ -212,9 +330,41 @@ def parse_date_header(email_content, filename=None):
         print(f"Error parsing date: {e}")
         return None
     
+def decode_bytes(raw_body, encoding):
+    """
+    Strictly decode bytes with the given encoding.
+    Encodings that bytes.decode has built-in fast paths for are decoded directly,
+    other codecs are looked up once and their decode function is reused.
+    """
+    if encoding.lower() in FAST_PATH_ENCODINGS:
+        return raw_body.decode(encoding)
+    
+    decoder = DECODERS.get(encoding)
+    if decoder is None:
+        decoder = DECODERS[encoding] = codecs.lookup(encoding).decode
+    return decoder(raw_body)[0]
+
+def decode_raw_header(value):
+    """
+    Decode a header value that contains raw 8-bit bytes as UTF-8, falling back to ISO-8859-1.
+    Headers parsed from bytes return such values as Header objects.
+    """
+    if isinstance(value, str):
+        return value
+    raw = b''.join(part for part, _ in decode_header(value))
+    try:
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('iso-8859-1')
+
 def try_decode_with_encodings(raw_body, declared_charset=None):
     """Try to decode the raw body with various encodings, with special handling for ISO-8859-1."""
     
+    # Most bodies are plain ASCII, which decodes the same with every encoding we try
+    if raw_body.isascii():
+        print("Successfully decoded with: ascii")
+        return raw_body.decode('ascii')
+    
     # Check if we have the f8 byte sequence which indicates ISO-8859-1 'ø'
     has_f8 = b'\xf8' in raw_body
     
@@ -230,7 +380,7 @@ def try_decode_with_encodings(raw_body, declared_charset=None):
     # Try the declared charset first if we have one
     if declared_charset:
         try:
-            decoded = raw_body.decode(declared_charset)
+            decoded = decode_bytes(raw_body, declared_charset)
             print(f"Successfully decoded with declared charset: {declared_charset}")
             return decoded
         except UnicodeDecodeError:
@@ -240,7 +390,7 @@ def try_decode_with_encodings(raw_body, declared_charset=None):
     encodings = ['utf-8', 'iso-8859-1', 'windows-1252', 'cp1252']
     for encoding in encodings:
         try:
-            decoded = raw_body.decode(encoding)
+            decoded = decode_bytes(raw_body, encoding)
             print(f"Successfully decoded with: {encoding}")
             return decoded
         except UnicodeDecodeError:
@@ -263,18 +413,19 @@ def process_eml_file(file_path, original_root, fixed_root):
         # Calculate relative path from original_root
         rel_path = file_path.relative_to(original_root)
         fixed_path = fixed_root / rel_path
-        fixed_path.parent.mkdir(parents=True, exist_ok=True)
+        ensure_directory(fixed_path.parent)
         
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
+        # Read the raw bytes so body bytes are never lost before decoding
+        with open(file_path, 'rb') as f:
+            raw = f.read()
         
         # Get the original send date, passing both content and filename
-        original_date = parse_date_header(content, str(file_path.name))
+        original_date = parse_date_header(raw, str(file_path.name))
         if not original_date:
             raise ValueError(f"Could not find or parse Date header in {file_path.name}")
 
         # Parse the original message
-        msg = email.message_from_string(content)
+        msg = email.message_from_bytes(raw)
         
         # Create new message preserving the original MIME structure
         new_msg = email.message.Message()
@@ -283,9 +434,9 @@ def process_eml_file(file_path, original_root, fixed_root):
         formatted_date = email.utils.formatdate(original_date.timestamp(), localtime=True)
         
         # Add core headers first
-        new_msg['From'] = msg.get('From', '')
-        new_msg['To'] = msg.get('To', '')
-        new_msg['Subject'] = msg.get('Subject', '')
+        new_msg['From'] = decode_raw_header(msg.get('From', ''))
+        new_msg['To'] = decode_raw_header(msg.get('To', ''))
+        new_msg['Subject'] = decode_raw_header(msg.get('Subject', ''))
         new_msg['Message-ID'] = msg.get('Message-ID', '')
         new_msg['Date'] = formatted_date
         
@@ -332,23 +483,49 @@ def process_eml_file(file_path, original_root, fixed_root):
             charset = msg.get_content_charset()
             if charset:
                 try:
-                    body = raw_body.decode(charset)
+                    body = decode_bytes(raw_body, charset)
                 except UnicodeDecodeError:
                     body = try_decode_with_encodings(raw_body, charset)
             else:
                 body = try_decode_with_encodings(raw_body)
-            new_msg.set_payload(body)
+            
+            # The body is written decoded as UTF-8, so the headers must say so
+            if body.isascii():
+                new_msg.replace_header('Content-Transfer-Encoding', '7bit')
+            else:
+                new_msg.replace_header('Content-Transfer-Encoding', '8bit')
+                if msg.get_content_maintype() == 'text' and charset != 'utf-8':
+                    new_msg.set_param('charset', 'utf-8', replace=True)
+            
+            # Store the UTF-8 bytes so the generator writes them unchanged
+            new_msg.set_payload(body.encode('utf-8').decode('ascii', 'surrogateescape'))
         
-        # Write the complete message
-        with open(fixed_path, 'w', encoding='utf-8') as f:
-            f.write(str(new_msg))
+        # Write the complete message, keeping the original bytes of every part
+        with open(fixed_path, 'wb') as f:
+            BytesGenerator(f, mangle_from_=False, maxheaderlen=0).flatten(new_msg)
             
         return True
         
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
         return False
-    
+
+def process_one_file(file_path, original_root, fixed_root):
+    """
+    Process a single .eml file in a worker process.
+    Returns (success, error message) so one bad file doesn't stop the others.
+    """
+    try:
+        if process_eml_file(file_path, original_root, fixed_root):
+            return True, None
+        return False, "Could not find or parse Date header"
+    except Exception as e:
+        return False, str(e)
+
+def process_batch(file_paths, original_root, fixed_root):
+    """Process a batch of .eml files in a worker process, returning one result per file."""
+    return [process_one_file(file_path, original_root, fixed_root) for file_path in file_paths]
+
 def process_folder(input_path: Path):
     """Process all .eml files in the specified folder structure."""
     print(header("Email Date Fixer"))
@@ -365,14 +542,22 @@ def process_folder(input_path: Path):
     
     # Process all .eml files while preserving directory structure
     print(section("Processing Files"))
-    for eml_file in input_path.rglob('*.eml'):
-        try:
-            if process_eml_file(eml_file, input_path, fixed_root):
+    
+    def collect_results(batch, results):
+        nonlocal successful
+        for eml_file, (ok, error_msg) in zip(batch, results):
+            if ok:
                 successful += 1
             else:
-                failed_files.append((str(eml_file.relative_to(input_path)), "Could not find or parse Date header"))
-        except Exception as e:
-            failed_files.append((str(eml_file.relative_to(input_path)), str(e)))
+                failed_files.append((str(eml_file.relative_to(input_path)), error_msg))
+    
+    # Files are independent, so spread them over all CPU cores in batches to keep
+    # the overhead low. Batches are submitted while the folders are still being
+    # scanned, and the number of waiting batches is limited to keep memory bounded.
+    with ProcessPoolExecutor() as executor:
+        for batch, results in process_in_batches(executor, process_batch, input_path.rglob('*.eml'),
+                                                 BATCH_SIZE, input_path, fixed_root):
+            collect_results(batch, results)
     
     # Print final summary after all files are processed
     print(section("Processing Results"))
@@ -13,7 +13,12 @@ When selecting which version of a duplicate to keep, the script:
 2. If tied, selects the file with the shortest path (assuming it's in a more logical location)
 
 Usage:
-    python 2-delete_duplicates.py ./1-fixed/2024/
+    python 2-delete_duplicates.py ./1-fixed/2024/ [--hardlink]
+
+    With --hardlink, kept files are hard linked into the output directory instead
+    of copied. This is much faster for large mailboxes, but the output files then
+    share their contents with the input files, so editing one changes both.
+    Files are copied as usual if linking fails (e.g. across different disks).
 
 Input:
     Expects a directory of .eml files, typically output from email_date_fixer.py
@@ -29,61 +34,80 @@ Note:
 """
 
 import os
-import sys
-import email
+import argparse
 import hashlib
 import shutil
 from pathlib import Path
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from color_utils import *
 from datetime import datetime
-from folder_utils import setup_output_directory
+from folder_utils import ensure_directory, setup_output_directory
+from header_utils import get_header_block, get_header_value
+
+# UTF-8 encoding of the Unicode replacement character (\ufffd)
+REPLACEMENT_CHARACTER_BYTES = '\ufffd'.encode('utf-8')
 
 def get_email_key(file_path):
     """
     Get a unique key for the email based on:
     1. Message-ID (primary)
-    2. From + To + Date (fallback)
+    2. A 16-byte fingerprint of From + To + Date (fallback)
+    Also returns a readable label for the key (the Message-ID or "from|to|date"),
+    and the number of Unicode replacement characters (\ufffd) in the email,
+    so the content does not need to be kept for choosing between duplicates.
     """
     try:
-        with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-            content = f.read()
-            
-        msg = email.message_from_string(content)
+        with open(file_path, 'rb') as f:
+            raw = f.read()
         
-        # Store original content for later comparison
-        metadata = {'content': content}
+        # Count replacement characters by their UTF-8 bytes, so the body never
+        # has to be decoded, and only decode the headers needed for the key
+        ufffd_count = raw.count(REPLACEMENT_CHARACTER_BYTES)
+        content = get_header_block(raw).decode('utf-8', errors='ignore')
         
-        message_id = msg.get('Message-ID', '').strip()
+        message_id = get_header_value(content, 'Message-ID').strip()
         if message_id:
             # If we have a Message-ID, use it as the key
-            key = message_id.lower()
+            key = label = message_id.lower()
         else:
             # Fallback: combine From + To + Date
-            from_addr = msg.get('From', '').lower().strip()
-            to_addr = msg.get('To', '').lower().strip()
-            date = msg.get('Date', '').strip()
+            from_addr = get_header_value(content, 'From').lower().strip()
+            to_addr = get_header_value(content, 'To').lower().strip()
+            date = get_header_value(content, 'Date').strip()
             
-            # Create a composite key
-            key = f"{from_addr}|{to_addr}|{date}"
+            # Key on a short fixed-size fingerprint of the composite, which is cheaper
+            # to hash and compare in the groups dict, and keep the composite as label
+            label = f"{from_addr}|{to_addr}|{date}"
+            key = hashlib.blake2b(label.encode('utf-8'), digest_size=16).digest()
         
-        return key, metadata
+        return key, label, ufffd_count
         
     except Exception as e:
         print(f"Error processing {file_path}: {e}")
-        return None, None
+        return None, None, None
 
 def select_best_version(duplicates):
     """
     Select the best version from duplicates by preferring:
     1. Files without Unicode replacement characters (\ufffd)
     2. If tied, take the one with the shortest path (assuming it's in a more logical location)
+    Each duplicate is a (ufffd_count, path_length, path) tuple, so the natural
+    tuple ordering matches this preference.
     """
-    return min(duplicates, 
-              key=lambda x: (x['metadata']['content'].count('\ufffd'), 
-                           len(str(x['path']))))
+    return min(duplicates)
 
-def process_duplicates(source_path: Path):
+def copy_file(src: Path, dst: Path, hardlink=False):
+    """Copy a file, or hard link it when requested, falling back to a copy if linking fails."""
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy2(src, dst)
+
+def process_duplicates(source_path: Path, hardlink=False):
     """Process duplicates from source path and create deduplicated output"""
     # Validate source path
     if not source_path.exists():
@@ -96,19 +120,24 @@ def process_duplicates(source_path: Path):
     
     # Find all duplicates
     duplicates = defaultdict(list)
-    total_files = 0
+    labels = {}
     
     # Process all .eml files
     print(header("Email Deduplicator"))
     print(section("Analyzing Files"))
-    for eml_file in source_path.rglob('*.eml'):
-        total_files += 1
-        key, metadata = get_email_key(eml_file)
-        if key:
-            duplicates[key].append({
-                'path': eml_file,
-                'metadata': metadata
-            })
+    eml_files = list(source_path.rglob('*.eml'))
+    total_files = len(eml_files)
+    
+    # Read the keys in parallel, then group them here in the main process
+    with ProcessPoolExecutor() as executor:
+        results = executor.map(get_email_key, eml_files, chunksize=64)
+        for eml_file, (key, label, ufffd_count) in zip(eml_files, results):
+            if key:
+                files = duplicates[key]
+                files.append((ufffd_count, len(str(eml_file)), eml_file))
+                # Labels are only needed for printing, so only keep them for duplicates
+                if len(files) == 2:
+                    labels[key] = label
     
     # Process each group of emails
     kept_files = 0
@@ -121,29 +150,30 @@ def process_duplicates(source_path: Path):
             total_duplicates += len(files) - 1
             
             # Select the best version
-            best_version = select_best_version(files)
+            best_path = select_best_version(files)[2]
             
             # Debug info for duplicates
-            print(section(f"Duplicate Group: {key}"))
-            print(info(f"Found {len(files)} copies, keeping: {best_version['path'].name}"))
-            for f in files:
-                if f == best_version:
-                    print(check(f"{f['path']}"))
+            print(section(f"Duplicate Group: {labels[key]}"))
+            print(info(f"Found {len(files)} copies, keeping: {best_path.name}"))
+            for _, _, path in files:
+                if path == best_path:
+                    print(check(f"{path}"))
                 else:
-                    print(bullet(f"{f['path']}"))
+                    print(bullet(f"{path}"))
 
             # Copy the best version
-            rel_path = best_version['path'].relative_to(source_path)
+            rel_path = best_path.relative_to(source_path)
             new_path = output_root / rel_path
-            new_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(best_version['path'], new_path)
+            ensure_directory(new_path.parent)
+            copy_file(best_path, new_path, hardlink)
             kept_files += 1
         else:
             # Not a duplicate, just copy it
-            rel_path = files[0]['path'].relative_to(source_path)
+            path = files[0][2]
+            rel_path = path.relative_to(source_path)
             new_path = output_root / rel_path
-            new_path.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(files[0]['path'], new_path)
+            ensure_directory(new_path.parent)
+            copy_file(path, new_path, hardlink)
             kept_files += 1
     
     # Print summary
@@ -156,9 +186,12 @@ def process_duplicates(source_path: Path):
     print(success(f"Files kept: {kept_files}"))
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        print("Usage: python 2-delete_duplicates.py ./1-fixed/2006")
-        print("Output will be created in: ./2-deduplicated/2006")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Remove duplicate emails. For ./1-fixed/2006, output will be created in: ./2-deduplicated/2006"
+    )
+    parser.add_argument('source', type=Path, help="folder of .eml files, e.g. ./1-fixed/2006")
+    parser.add_argument('--hardlink', action='store_true',
+                        help="hard link kept files instead of copying them")
+    args = parser.parse_args()
     
-    process_duplicates(Path(sys.argv[1]))
\ No newline at end of file
+    process_duplicates(args.source, hardlink=args.hardlink)
\ No newline at end of file
@@ -28,61 +28,345 @@ Note:
 """
 
 import os
+import re
+import mmap
 import sys
-import email
-import email.utils
-from datetime import datetime
+import heapq
+import pickle
+import tempfile
+from array import array
+from datetime import datetime, timedelta, timezone
 from color_utils import *
 from pathlib import Path
+from functools import lru_cache
+from concurrent.futures import ProcessPoolExecutor
 from email.utils import parsedate_to_datetime
+from folder_utils import iter_files, process_in_batches
+from header_utils import get_header_block, get_header_value, read_header_block
+
+# Lines in the email body starting with "From " must be escaped as ">From "
+FROM_LINE_PATTERN = re.compile(rb'(?m)^From ')
+
+# The address part of a "Name <email@example.com>" From header
+ADDRESS_PATTERN = re.compile(r'<([^>]*)>')
+
+# The most common Date header format, e.g. "Tue, 24 Dec 2024 10:12:47 +0100",
+# which can be parsed without the full RFC 2822 parser
+SIMPLE_DATE_PATTERN = re.compile(
+    r'(?:[A-Z][a-z]{2}, )?(\d{1,2}) ([A-Z][a-z]{2}) ([1-9]\d{3}) (\d\d):(\d\d):(\d\d) ([+-])(\d\d)(\d\d)'
+)
+MONTH_NUMBERS = {
+    'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+    'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12
+}
+
+# English day and month names for mbox separator lines, whatever the system locale
+WEEKDAY_NAMES = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTH_NAMES = (None, 'Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+               'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+# Recent dates to remember when parsing and formatting. Emails are written in date
+# order, so a small cache catches repeated dates while memory stays bounded
+DATE_CACHE_SIZE = 1024
+
+# One shared string per sender address, since a few senders often account for most emails
+SENDER_ADDRESSES = {}
+
+# The only headers the scan needs
+SCAN_HEADERS = ('Date', 'From')
+
+# Emails scanned per task in a worker process
+SCAN_BATCH_SIZE = 128
+
+# Emails sorted in memory before the sorted run is moved to a temporary file
+SORT_RUN_SIZE = 100000
+
+# Records per pickle when saving a sorted run
+SORT_BLOCK_SIZE = 1024
+
+# Emails up to this size are read whole during the scan and kept for the write pass
+SMALL_EMAIL_SIZE = 4 * 1024
+
+# Email tails at least this large are copied with os.sendfile where supported
+SENDFILE_MIN_SIZE = 64 * 1024
+
+# Only Linux can sendfile into a regular file (macOS only allows sockets). Turned off
+# after the first failure, so later emails don't pay for a flush and a failing call
+USE_SENDFILE = hasattr(os, 'sendfile') and sys.platform.startswith('linux')
+
+# How much to gather before writing to the mbox file, so small emails are written in large batches
+MBOX_WRITE_BUFFER = 4 * 1024 * 1024
+
+# Most pieces a single os.writev call accepts (IOV_MAX on Linux and macOS)
+WRITEV_MAX_BUFFERS = 1024
+
+class MboxWriteError(Exception):
+    """The mbox file itself could not be written, so the conversion cannot continue."""
+
+class MboxWriter:
+    """
+    Writes the mbox file by gathering pieces and handing them to os.writev together,
+    so separators and emails become one system call without being copied into a
+    single buffer first. Falls back to joining the pieces where os.writev is missing.
+    """
+    def __init__(self, path):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0)
+        self.path = path
+        self.fd = os.open(path, flags, 0o644)
+        self.buffers = []
+        self.size = 0
+        self.failed = False
+
+    def fileno(self):
+        return self.fd
+
+    def write(self, data):
+        if data:
+            self.buffers.append(data)
+            self.size += len(data)
+            if self.size >= MBOX_WRITE_BUFFER:
+                self.flush()
+
+    def flush(self):
+        buffers = self.buffers
+        i = 0
+        try:
+            while i < len(buffers):
+                batch = buffers[i:i + WRITEV_MAX_BUFFERS]
+                if hasattr(os, 'writev'):
+                    written = os.writev(self.fd, batch)
+                else:
+                    written = os.write(self.fd, b''.join(batch))
+                # Skip past what was written, keeping the rest of a partly written piece
+                while written:
+                    if written >= len(buffers[i]):
+                        written -= len(buffers[i])
+                        i += 1
+                    else:
+                        buffers[i] = memoryview(buffers[i])[written:]
+                        written = 0
+        except OSError as e:
+            self.failed = True
+            raise MboxWriteError(f"Could not write to {self.path}: {e}") from e
+        finally:
+            # Drop everything already written, so it can never be written twice
+            del buffers[:i]
+            self.size = sum(len(piece) for piece in buffers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            # Don't retry after a failed write, which would only fail again
+            if not self.failed:
+                self.flush()
+        finally:
+            os.close(self.fd)
 
 def get_default_output_path(input_path: Path) -> Path:
     """Generate default output path for mbox file"""
     folder_name = input_path.name
     return Path.cwd() / "3-mbox" / f"{folder_name}.mbox"
 
-def get_email_date_and_sender(eml_path):
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def parse_email_date(date_str):
+    """
+    Parse a Date header value into a datetime.
+    Emails often share the exact same Date value, so results are cached.
+    """
+    match = SIMPLE_DATE_PATTERN.fullmatch(date_str)
+    if match and match[2] in MONTH_NUMBERS:
+        day, month, year, hour, minute, second, sign, tz_hours, tz_minutes = match.groups()
+        try:
+            date = datetime(int(year), MONTH_NUMBERS[month], int(day),
+                            int(hour), int(minute), int(second))
+        except ValueError:
+            return parsedate_to_datetime(date_str)
+        # Like parsedate_to_datetime, -0000 means the timezone is unknown
+        if sign == '-' and tz_hours == tz_minutes == '00':
+            return date
+        offset = timedelta(hours=int(tz_hours), minutes=int(tz_minutes))
+        return date.replace(tzinfo=timezone(-offset if sign == '-' else offset))
+    
+    return parsedate_to_datetime(date_str)
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def format_mbox_date(date):
+    """
+    Format a naive datetime for an mbox separator line, caching repeated dates.
+    Same as strftime('%a %b %d %H:%M:%S %Y'), but always in English and without
+    the locale lookups.
+    """
+    return (f"{WEEKDAY_NAMES[date.weekday()]} {MONTH_NAMES[date.month]} {date.day:02d} "
+            f"{date.hour:02d}:{date.minute:02d}:{date.second:02d} {date.year}")
+
+def get_email_date_and_sender(eml_path, keep_content=True):
     """
     Extract the date and sender from an email file.
-    Returns (datetime_obj, from_address) tuple.
+    With keep_content, small emails are read whole and returned too, so they don't
+    need to be read again.
+    Returns (datetime_obj, from_address, content) tuple, where content is None for
+    larger emails or without keep_content.
     """
     try:
-        with open(eml_path, 'r', encoding='utf-8') as f:
-            msg = email.message_from_file(f)
+        # Only the Date and From headers are needed, so stop reading once both are found
+        with open(eml_path, 'rb') as f:
+            content = f.read(SMALL_EMAIL_SIZE + 1) if keep_content else None
+            if content is not None and len(content) <= SMALL_EMAIL_SIZE:
+                header_bytes = get_header_block(content)
+            else:
+                content = None
+                f.seek(0)
+                header_bytes = read_header_block(f, SCAN_HEADERS)
+        headers = header_bytes.decode('utf-8', errors='surrogateescape')
             
         # Get and parse the date
-        date_str = msg.get('Date')
+        date_str = get_header_value(headers, 'Date')
         if date_str:
-            date = parsedate_to_datetime(date_str)
+            date = parse_email_date(date_str)
         else:
             # If no date found, use file modification time as fallback
             date = datetime.fromtimestamp(os.path.getmtime(eml_path))
             
         # Get the sender address
-        from_header = msg.get('From', '')
+        from_header = get_header_value(headers, 'From')
         # Extract email address from "Name <email@example.com>" format
-        if '<' in from_header and '>' in from_header:
-            from_addr = from_header.split('<')[1].split('>')[0]
+        address = ADDRESS_PATTERN.search(from_header)
+        if address:
+            from_addr = address.group(1)
         else:
             from_addr = from_header.strip()
             
         if not from_addr:
             from_addr = 'unknown@unknown.com'
             
-        return date, from_addr
+        return date, from_addr, content
         
     except Exception as e:
         print(f"Error processing {eml_path}: {e}")
-        return None, None
+        return None, None, None
 
 def create_mbox_separator(date, from_addr):
     """
-    Create an mbox separator line using the email's date and sender.
+    Create an mbox separator line using the email's date and sender, as bytes.
     Format: From sender@example.com Tue Dec 24 10:12:47 2024
     """
-    # Format the date to mbox format (removing timezone info)
-    date_str = date.strftime('%a %b %d %H:%M:%S %Y')
-    return f"From {from_addr} {date_str}\n"
+    # Format the date to mbox format (removing timezone info). The cache is keyed
+    # on the naive time, since equal times in different zones format differently,
+    # and without microseconds, which the mtime fallback dates carry
+    date_str = format_mbox_date(date.replace(tzinfo=None, microsecond=0))
+    return f"From {from_addr} {date_str}\n".encode('utf-8', errors='surrogateescape')
+
+def write_email_content(mbox, content):
+    """
+    Write an email to the mbox with Unix line endings and "From " lines escaped.
+    Content can be bytes or an mmap, and is only copied if something needs changing.
+    """
+    if content.find(b'\r') >= 0:
+        content = content[:].replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+    # A plain find is much faster than a search with the multiline regex
+    if content[:5] == b'From ' or content.find(b'\nFrom ') >= 0:
+        content = FROM_LINE_PATTERN.sub(b'>From ', content)
+    mbox.write(content)
+
+def copy_email_file(mbox, eml):
+    """
+    Copy an email file opened in binary mode into the mbox.
+    Smaller emails are read in one go, so they are gathered with the other writes
+    instead of each being mapped and flushed on its own.
+    For larger emails, only the part up to the last line that needs changing goes
+    through Python. A large unchanged tail (e.g. an attachment) is copied by the kernel
+    with os.sendfile on Linux.
+    """
+    size = os.fstat(eml.fileno()).st_size
+    if size < SENDFILE_MIN_SIZE:
+        write_email_content(mbox, eml.read())
+        return
+    
+    with mmap.mmap(eml.fileno(), 0, access=mmap.ACCESS_READ) as content:
+        # Find where the last carriage return or "From " line ends
+        tail_start = content.rfind(b'\r') + 1
+        if content[tail_start:tail_start + 1] == b'\n':
+            tail_start += 1
+        last_from = max(content.rfind(b'\nFrom '), content.rfind(b'\rFrom '))
+        if last_from >= 0:
+            tail_start = max(tail_start, last_from + 6)
+        elif content[:5] == b'From ':
+            tail_start = max(tail_start, 5)
+        
+        if tail_start:
+            write_email_content(mbox, content[:tail_start])
+        
+        offset = tail_start
+        global USE_SENDFILE
+        if USE_SENDFILE and size - offset >= SENDFILE_MIN_SIZE:
+            mbox.flush()
+            try:
+                while offset < size:
+                    sent = os.sendfile(mbox.fileno(), eml.fileno(), offset, size - offset)
+                    if not sent:
+                        break
+                    offset += sent
+            except OSError:
+                # Not supported for these files, so write the rest normally from now on
+                USE_SENDFILE = False
+        
+        if offset < size:
+            if offset:
+                mbox.write(content[offset:])
+            else:
+                # The mapping is closed when this function returns, so write it out now
+                mbox.write(content)
+                mbox.flush()
+
+def scan_batch(batch):
+    """
+    Scan a batch of (eml_path, keep_content) pairs in a worker process, returning
+    one result per file.
+    """
+    return [get_email_date_and_sender(eml_path, keep_content) for eml_path, keep_content in batch]
+
+def sort_run(timestamps, paths, dates, senders, contents):
+    """
+    Sort a run of scan results kept in parallel lists by date.
+    Yields (timestamp, path, date, from_address, content) records in order.
+    """
+    # Sort the indexes by path, then by date. The sort is stable, so emails with the
+    # same date stay in path order. Timestamps are used so emails with and without
+    # timezone info can be compared
+    order = sorted(range(len(paths)), key=paths.__getitem__)
+    order.sort(key=timestamps.__getitem__)
+    for i in order:
+        yield timestamps[i], paths[i], dates[i], senders[i], contents[i]
+
+def save_sorted_run(records):
+    """
+    Save sorted records to a temporary file, returning the file ready for reading.
+    The content of small emails is left out, so they are read again when writing.
+    Only the last run stays in memory with its content, which is why the scan
+    stops asking for content once the first run has been saved.
+    """
+    run_file = tempfile.TemporaryFile()
+    block = []
+    for timestamp, eml_path, date, from_addr, _ in records:
+        block.append((timestamp, eml_path, date, from_addr, None))
+        if len(block) == SORT_BLOCK_SIZE:
+            pickle.dump(block, run_file)
+            block = []
+    if block:
+        pickle.dump(block, run_file)
+    run_file.seek(0)
+    return run_file
+
+def iter_sorted_run(run_file):
+    """Yield the records of a sorted run saved by save_sorted_run."""
+    while True:
+        try:
+            block = pickle.load(run_file)
+        except EOFError:
+            return
+        yield from block
 
 def convert_to_mbox(input_dir, output_mbox):
     """Convert all .eml files in input_dir to a single mbox file."""
@@ -95,58 +379,111 @@ def convert_to_mbox(input_dir, output_mbox):
         
     # Find all .eml files and get their dates for sorting
     print(section("Scanning Directory"))
-    email_files = []
+    # Scan results are kept in parallel lists with one entry per email instead of a
+    # tuple per email, and the timestamps in a compact array for sorting
+    timestamps = array('d')
+    dates = []
+    senders = []
+    paths = []
+    contents = []
+    run_files = []
     total_found = 0
+    total_emails = 0
     
-    for eml_path in input_path.rglob('*.eml'):
-        total_found += 1
-        if total_found % 100 == 0:  # Progress indicator for large directories
-            print(info(f"Found {total_found} files..."))
-            
-        date, from_addr = get_email_date_and_sender(eml_path)
-        if date and from_addr:
-            email_files.append((date, from_addr, eml_path))
-        else:
-            print(warning(f"Skipping {eml_path.relative_to(input_path)} - Missing date or sender"))
+    # The walker's paths all start with the input directory, so messages can show
+    # paths relative to it by slicing instead of building Path objects
+    prefix_len = len(os.path.join(input_path, ''))
+    
+    def collect_results(batch, results):
+        nonlocal total_found, total_emails
+        for (eml_path, _), (date, from_addr, content) in zip(batch, results):
+            total_found += 1
+            if (total_found & 127) == 0:  # Progress indicator every 128 files for large directories
+                print(info(f"Found {total_found} files..."))
+                
+            if date and from_addr:
+                from_addr = SENDER_ADDRESSES.setdefault(from_addr, from_addr)
+                timestamps.append(date.timestamp())
+                dates.append(date)
+                senders.append(from_addr)
+                paths.append(eml_path)
+                contents.append(content)
+                total_emails += 1
+            else:
+                print(warning(f"Skipping {eml_path[prefix_len:]} - Missing date or sender"))
+        
+        # Move full runs to temporary files, so memory use stays bounded for huge archives
+        if len(paths) >= SORT_RUN_SIZE:
+            run_files.append(save_sorted_run(sort_run(timestamps, paths, dates, senders, contents)))
+            del timestamps[:]
+            for results in (dates, senders, paths, contents):
+                results.clear()
+    
+    # Saved runs drop the content of small emails, so once a run has been saved there
+    # is no point sending it back from the workers. Files are taken from the walker
+    # only as batches are submitted, so this is checked after the latest results
+    def iter_scan_items():
+        for eml_path in iter_files(input_path, '.eml'):
+            yield eml_path, not run_files
+    
+    # Read the headers in parallel in batches while the folders are still being
+    # walked, limiting the number of waiting batches to keep memory bounded
+    with ProcessPoolExecutor() as executor:
+        for batch, results in process_in_batches(executor, scan_batch, iter_scan_items(),
+                                                 SCAN_BATCH_SIZE):
+            collect_results(batch, results)
     
-    if not email_files:
+    if not total_emails:
         print(error("No valid .eml files found in the input directory"))
         return False
     
-    # Sort emails by date
+    # Merge the runs saved to temporary files with the last run still in memory
+    email_files = sort_run(timestamps, paths, dates, senders, contents)
+    if run_files:
+        email_files = heapq.merge(*map(iter_sorted_run, run_files), email_files)
+    
     print(section("Converting Files"))
-    print(info(f"Processing {len(email_files)} emails..."))
+    print(info(f"Processing {total_emails} emails..."))
     
     # Track statistics
     processed = 0
     errors = 0
     
-    # Create the mbox file
-    with open(output_mbox, 'w', encoding='utf-8') as mbox:
-        for date, from_addr, eml_path in email_files:
-            try:
-                # Write the mbox separator
-                separator = create_mbox_separator(date, from_addr)
-                mbox.write(separator)
-                
-                # Copy the email content
-                with open(eml_path, 'r', encoding='utf-8') as eml:
-                    for line in eml:
-                        if line.startswith('From '):
-                            line = '>' + line
-                        mbox.write(line)
-                
-                mbox.write('\n')
-                processed += 1
-                
-                # Show progress every 100 files
-                if processed % 100 == 0:
-                    print(bullet(f"Processed {processed}/{len(email_files)} emails..."))
-                
-            except Exception as e:
-                print(error(f"Error processing {eml_path.relative_to(input_path)}: {e}"))
-                errors += 1
-                continue
+    # Create the mbox file. Errors reading an email skip just that email, but an
+    # error writing the mbox stops the conversion
+    try:
+        with MboxWriter(output_mbox) as mbox:
+            for _, eml_path, date, from_addr, content in email_files:
+                try:
+                    separator = create_mbox_separator(date, from_addr)
+                    if content is not None:
+                        # Small emails were already read whole during the scan
+                        mbox.write(separator)
+                        write_email_content(mbox, content)
+                    else:
+                        with open(eml_path, 'rb') as eml:
+                            mbox.write(separator)
+                            copy_email_file(mbox, eml)
+                    
+                    mbox.write(b'\n')
+                    processed += 1
+                    
+                    # Show progress every 128 files (a bit mask is cheaper than %)
+                    if (processed & 127) == 0:
+                        print(bullet(f"Processed {processed}/{total_emails} emails..."))
+                    
+                except MboxWriteError:
+                    raise
+                except Exception as e:
+                    print(error(f"Error processing {eml_path[prefix_len:]}: {e}"))
+                    errors += 1
+                    continue
+    except MboxWriteError as e:
+        print(error(f"Error: {e}"))
+        return False
+    finally:
+        for run_file in run_files:
+            run_file.close()
     
     # Print final summary
     print(section("Conversion Summary"))
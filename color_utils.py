@@ -10,25 +10,31 @@ from colorama import init, Fore, Style, Back
 # Initialize colorama
 init()
 
+# Precomputed color codes and symbols, so messages only need one concatenation
+RESET = Style.RESET_ALL
+BULLET_PREFIX = f"{Fore.CYAN}•{RESET} "
+CHECK_PREFIX = f"{Fore.GREEN}✓{RESET} "
+CROSS_PREFIX = f"{Fore.RED}✗{RESET} "
+
 def success(msg):
     """Print success message in green"""
-    return f"{Fore.GREEN}{msg}{Style.RESET_ALL}"
+    return Fore.GREEN + msg + RESET
 
 def error(msg):
     """Print error message in red"""
-    return f"{Fore.RED}{msg}{Style.RESET_ALL}"
+    return Fore.RED + msg + RESET
 
 def warning(msg):
     """Print warning message in yellow"""
-    return f"{Fore.YELLOW}{msg}{Style.RESET_ALL}"
+    return Fore.YELLOW + msg + RESET
 
 def info(msg):
     """Print info message in cyan"""
-    return f"{Fore.CYAN}{msg}{Style.RESET_ALL}"
+    return Fore.CYAN + msg + RESET
 
 def highlight(msg):
     """Print highlighted message in magenta"""
-    return f"{Fore.MAGENTA}{msg}{Style.RESET_ALL}"
+    return Fore.MAGENTA + msg + RESET
 
 def header(msg):
     """Print header with cyan background"""
@@ -40,12 +46,12 @@ def section(name):
 
 def bullet(msg):
     """Print bullet point in cyan"""
-    return f"{Fore.CYAN}•{Style.RESET_ALL} {msg}"
+    return BULLET_PREFIX + msg
 
 def check(msg):
     """Print checkmark in green with message"""
-    return f"{Fore.GREEN}✓{Style.RESET_ALL} {msg}"
+    return CHECK_PREFIX + msg
 
 def cross(msg):
     """Print cross mark in red with message"""
-    return f"{Fore.RED}✗{Style.RESET_ALL} {msg}"
\ No newline at end of file
+    return CROSS_PREFIX + msg
\ No newline at end of file
@@ -1,8 +1,13 @@
 """
 Common utilities for folder handling across email migration scripts
 """
+import os
+from collections import deque
 from pathlib import Path
 
+# Directories already created by ensure_directory in this process
+CREATED_DIRECTORIES = set()
+
 def get_unique_folder_name(base_path: Path) -> Path:
     """
     Get a unique folder name by appending (n) if the folder already exists.
@@ -18,6 +23,66 @@ def get_unique_folder_name(base_path: Path) -> Path:
             return new_path
         counter += 1
 
+def ensure_directory(path: Path) -> None:
+    """
+    Create a directory and its parents, skipping the mkdir call if this
+    process already created it.
+    Example: for 10,000 files in one folder, mkdir is only called once
+    """
+    if path not in CREATED_DIRECTORIES:
+        path.mkdir(parents=True, exist_ok=True)
+        CREATED_DIRECTORIES.add(path)
+
+def iter_files(root, suffix: str):
+    """
+    Recursively yield the paths of all files under root ending with suffix, as strings.
+    Uses os.scandir, which is much faster than Path.rglob on large folders since it
+    needs no extra stat calls and creates no Path objects.
+    Example: iter_files("./2-deduplicated/2006", ".eml")
+    """
+    stack = [os.fspath(root)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue  # Skip unreadable or vanished folders, like rglob does
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith(suffix):
+                    yield entry.path
+
+def iter_batches(items, batch_size):
+    """Yield lists of up to batch_size items from any iterable, without reading it all first."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def process_in_batches(executor, function, items, batch_size, *args):
+    """
+    Run function(batch, *args) on an executor for batches of items, and yield
+    (batch, result) pairs in order.
+    Batches are submitted while the items are still being produced (e.g. while the
+    folders are still being scanned), and the number of waiting batches is limited
+    to keep memory bounded.
+    """
+    max_pending = 4 * (os.cpu_count() or 1)
+    pending = deque()
+    for batch in iter_batches(items, batch_size):
+        pending.append((batch, executor.submit(function, batch, *args)))
+        if len(pending) >= max_pending:
+            batch, future = pending.popleft()
+            yield batch, future.result()
+    while pending:
+        batch, future = pending.popleft()
+        yield batch, future.result()
+
 def setup_output_directory(input_path: Path, stage_name: str) -> Path:
     """
     Create output directory based on input folder name.
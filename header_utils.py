@@ -0,0 +1,104 @@
+"""
+Common utilities for reading email headers without parsing the full message
+"""
+import string
+
+# Lowercases ASCII letters only, so header positions stay the same
+ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+# How much of a file to read at a time when looking for the end of the headers
+HEADER_READ_SIZE = 8 * 1024
+
+def get_header_block(email_content):
+    """
+    Return the header block of an email, up to and including the first blank line.
+    Works on both str and bytes content.
+    Returns the whole content if there is no blank line.
+    """
+    if isinstance(email_content, bytes):
+        blank_lines = (b'\n', b'\r\n')
+        separators = (b'\n\n', b'\r\n\r\n')
+    else:
+        blank_lines = ('\n', '\r\n')
+        separators = ('\n\n', '\r\n\r\n')
+
+    if email_content.startswith(blank_lines):
+        return email_content[:0]
+
+    ends = []
+    for separator in separators:
+        pos = email_content.find(separator)
+        if pos >= 0:
+            ends.append(pos + len(separator))
+
+    if not ends:
+        return email_content
+    return email_content[:min(ends)]
+
+def has_complete_headers(header_bytes: bytes, names) -> bool:
+    """
+    Check whether the first header with each of the given names, including any
+    continuation lines, is fully contained in the start of a header block.
+    """
+    headers = b'\n' + header_bytes.lower()
+    for name in names:
+        start = headers.find(b'\n' + name.lower().encode('ascii') + b':')
+        if start < 0:
+            return False
+        # The value is only complete once the next line is known not to continue it
+        end = headers.find(b'\n', start + 1)
+        while end >= 0 and headers[end + 1:end + 2] in (b' ', b'\t'):
+            end = headers.find(b'\n', end + 1)
+        if end < 0 or end + 1 >= len(headers):
+            return False
+    return True
+
+def read_header_block(email_file, names=()) -> bytes:
+    """
+    Read only the header block of an email file, stopping at the first blank line
+    instead of reading the whole message into memory.
+    Takes a path, or a file opened in binary mode to read from its current position.
+    If header names are given, also stops as soon as those headers have been read,
+    and may then return only the start of the header block.
+    Example: read_header_block(path, ('Date', 'From'))
+    """
+    if not hasattr(email_file, 'read'):
+        with open(email_file, 'rb') as f:
+            return read_header_block(f, names)
+
+    data = b''
+    while True:
+        chunk = email_file.read(HEADER_READ_SIZE)
+        if not chunk:
+            break
+        # Start a little before the new chunk in case a blank line is split across reads
+        search_from = max(len(data) - 3, 0)
+        data += chunk
+        if (data.startswith((b'\n', b'\r\n'))
+                or data.find(b'\n\n', search_from) >= 0
+                or data.find(b'\r\n\r\n', search_from) >= 0
+                or (names and has_complete_headers(data, names))):
+            break
+    return get_header_block(data)
+
+def get_header_value(email_content: str, name: str) -> str:
+    """
+    Get the value of the first header with the given name, including any
+    continuation lines, without parsing the message.
+    Example: for "Message-ID: <abc@example.com>" returns "<abc@example.com>"
+    Returns an empty string if the header is missing.
+    """
+    headers = '\n' + get_header_block(email_content)
+    start = headers.translate(ASCII_LOWER).find('\n' + name.lower() + ':')
+    if start < 0:
+        return ''
+    start += len(name) + 2
+
+    # The value ends at the first line break not followed by a continuation line
+    end = headers.find('\n', start)
+    while end >= 0 and headers[end + 1:end + 2] in (' ', '\t'):
+        end = headers.find('\n', end + 1)
+    if end < 0:
+        end = len(headers)
+
+    return headers[start:end].lstrip(' \t').rstrip('\r\n')